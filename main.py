@@ -1,4 +1,5 @@
 import os
+import hmac
 import logging
 import asyncio
 import uuid
@@ -6,21 +7,28 @@ import string
 import random
 import httpx
 import re
-from telegram import Update, BotCommand, ReplyKeyboardMarkup, ReplyKeyboardRemove
+import warnings
+from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
+    AIORateLimiter,
     Application,
+    BaseUpdateProcessor,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     ContextTypes,
     ConversationHandler,
     filters
 )
-from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from telegram.warnings import PTBUserWarning
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import ORJSONResponse
 import uvicorn
 import io
 import json
-from contextlib import asynccontextmanager
+import orjson
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
 import qrcode
 from typing import Tuple
 
@@ -34,6 +42,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# The menu conversation is tracked per chat/user on purpose; per-message tracking
+# would rule out the CommandHandlers it also uses.
+warnings.filterwarnings("ignore", message=r".*CallbackQueryHandler", category=PTBUserWarning)
+
 # Load environment variables
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 RENDER_EXTERNAL_URL = os.getenv('RENDER_EXTERNAL_URL')
@@ -44,14 +56,55 @@ DEV_HANDLE = "@aadi_io"
 if not TELEGRAM_TOKEN:
     logger.critical("FATAL: TELEGRAM_BOT_TOKEN environment variable not set. Bot cannot start.")
     exit(1)
+TOKEN_BYTES = TELEGRAM_TOKEN.encode()
 
 # Global variables to track bot status for health checks
 application = None
 bot_status = {"initialized": False, "webhook_verified": False, "error": None, "details": {}}
+bot_ready = asyncio.Event()
+STARTUP_WAIT_SECONDS = 5
+MAX_CONCURRENT_UPDATES = 1024
 
 # Conversation states
 MAIN_MENU, INSTA_MODE = range(2)
 
+# Static replies, built once at import
+MAIN_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Instagram Reset", callback_data="insta")],
+    [InlineKeyboardButton("Generate Password", callback_data="genpass"), InlineKeyboardButton("Shorten URL", callback_data="shorten")],
+    [InlineKeyboardButton("Create QR Code", callback_data="qr"), InlineKeyboardButton("Help", callback_data="help")]
+])
+WELCOME_TEMPLATE = (
+    "Hello {name}!\n\n"
+    "Welcome to the Utility Bot.\n\n"
+    "Select a feature to get started:\n"
+    "- Instagram Reset\n"
+    "- Generate Password\n"
+    "- Shorten URL\n"
+    "- Create QR Code\n\n"
+    f"Developed by {DEV_HANDLE}"
+)
+INSTA_MODE_TEXT = (
+    "Instagram Reset Mode Activated.\n\n"
+    "Available Commands:\n"
+    "/rst <username> - Reset by username\n"
+    "/blk <user1> <user2> - Bulk reset (max 3)\n\n"
+    "Use /mode to return to the menu."
+)
+GENPASS_HINT = "Send /genpass or /genpass <length> to create a password."
+SHORTEN_HINT = "Send /shorten <your_url> to get a short link."
+QR_HINT = "Send /qr <text_or_url> to generate a QR code."
+HELP_TEXT = (
+    "Help Guide:\n\n"
+    "/start or /mode - Return to the main menu.\n"
+    "/rst <target> - Reset an Instagram account.\n"
+    "/blk <targets> - Bulk reset IG accounts.\n"
+    "/genpass <len> - Generate a secure password.\n"
+    "/shorten <url> - Shorten a long URL.\n"
+    "/qr <text> - Create a QR code."
+)
+ABOUT_TEXT = f"Multi-utility bot by {DEV_HANDLE}."
+
 # =========================
 # Core Features
 # =========================
@@ -95,55 +148,38 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command - entry point to main menu."""
     try:
         user = update.effective_user
-        reply_keyboard = [
-            ["Instagram Reset"],
-            ["Generate Password", "Shorten URL"],
-            ["Create QR Code", "Help"]
-        ]
-        welcome_message = (
-            f"Hello {user.first_name}!\n\n"
-            "Welcome to the Utility Bot.\n\n"
-            "Select a feature to get started:\n"
-            "- Instagram Reset\n"
-            "- Generate Password\n"
-            "- Shorten URL\n"
-            "- Create QR Code\n\n"
-            f"Developed by {DEV_HANDLE}"
-        )
         await update.message.reply_text(
-            welcome_message,
-            reply_markup=ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
+            WELCOME_TEMPLATE.format(name=user.first_name),
+            reply_markup=MAIN_KEYBOARD
         )
         return MAIN_MENU
     except Exception as e:
         logger.error(f"Error in start_command: {e}")
-        await update.message.reply_text("Welcome! Please select a feature using the keyboard.")
+        await update.message.reply_text("Welcome! Please select a feature using the buttons.")
         return MAIN_MENU
 
 async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle main menu selections."""
-    text = update.message.text
-    if text == "Instagram Reset":
-        return await switch_to_insta_mode(update, context)
-    elif text == "Generate Password":
-        await update.message.reply_text("Send /genpass or /genpass <length> to create a password.", reply_markup=ReplyKeyboardRemove())
-    elif text == "Shorten URL":
-        await update.message.reply_text("Send /shorten <your_url> to get a short link.", reply_markup=ReplyKeyboardRemove())
-    elif text == "Create QR Code":
-        await update.message.reply_text("Send /qr <text_or_url> to generate a QR code.", reply_markup=ReplyKeyboardRemove())
-    elif text == "Help":
-        await help_command(update, context)
+    """Handle main menu selections; unknown buttons leave the state unchanged."""
+    query = update.callback_query
+    await query.answer()
+    handler = MENU_DISPATCH.get(query.data)
+    if handler:
+        return await handler(update, context)
+    return None
+
+def menu_hint(text: str):
+    """Builds a main-menu handler that replies with a usage hint."""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.effective_message.reply_text(text)
+        return MAIN_MENU
+    return handler
+
+async def menu_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await help_command(update, context)
     return MAIN_MENU
 
 async def switch_to_insta_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = (
-        "Instagram Reset Mode Activated.\n\n"
-        "Available Commands:\n"
-        "/rst <username> - Reset by username\n"
-        "/blk <user1> <user2> - Bulk reset (max 3)\n\n"
-        "Use /mode to return to the menu."
-    )
-    await update.message.reply_text(message, reply_markup=ReplyKeyboardRemove())
+    await update.effective_message.reply_text(INSTA_MODE_TEXT)
     return INSTA_MODE
 
 async def mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -262,28 +298,70 @@ async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- Help, About, Error ---
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = (
-        "Help Guide:\n\n"
-        "/start or /mode - Return to the main menu.\n"
-        "/rst <target> - Reset an Instagram account.\n"
-        "/blk <targets> - Bulk reset IG accounts.\n"
-        "/genpass <len> - Generate a secure password.\n"
-        "/shorten <url> - Shorten a long URL.\n"
-        "/qr <text> - Create a QR code."
-    )
-    await update.message.reply_text(message)
+    await update.effective_message.reply_text(HELP_TEXT)
 
 async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(f"Multi-utility bot by {DEV_HANDLE}.")
+    await update.message.reply_text(ABOUT_TEXT)
+
+MENU_DISPATCH = {
+    "insta": switch_to_insta_mode,
+    "genpass": menu_hint(GENPASS_HINT),
+    "shorten": menu_hint(SHORTEN_HINT),
+    "qr": menu_hint(QR_HINT),
+    "help": menu_help,
+}
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Update {update} caused error: {context.error}", exc_info=context.error)
-    if update and update.effective_message: await update.message.reply_text("An unexpected error occurred.")
+    if update and update.effective_message: await update.effective_message.reply_text("An unexpected error occurred.")
 
 # =========================
 # Bot Setup & Web Server
 # =========================
 
+@dataclass
+class ChatQueue:
+    """Serializes one chat's updates; dropped once nothing for the chat is pending."""
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending: int = 0
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently across chats but one at a time within each chat."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {}
+
+    async def process_update(self, update, coroutine):
+        # Take the chat's turn before a concurrency slot, so a burst from one chat
+        # waits on its own queue instead of holding slots other chats need.
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._slots:
+                await self.do_process_update(update, coroutine)
+            return
+
+        queue = self._chats.setdefault(chat.id, ChatQueue())
+        queue.pending += 1
+        try:
+            async with queue.lock:
+                async with self._slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            queue.pending -= 1
+            if not queue.pending:
+                del self._chats[chat.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
 async def initialize_bot():
     """Robust bot initialization with detailed logging and webhook verification."""
     global application
@@ -294,16 +372,28 @@ async def initialize_bot():
         return
 
     try:
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
+        rate_limiter = AIORateLimiter(overall_max_rate=28, overall_time_period=1, max_retries=3)
+        application = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .connection_pool_size(256)
+            .pool_timeout(30)
+            .connect_timeout(10)
+            .read_timeout(20)
+            .rate_limiter(rate_limiter)
+            .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+            .build()
+        )
         
         conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("start", start_command)],
+            entry_points=[CommandHandler("start", start_command), CallbackQueryHandler(main_menu_handler)],
             states={
-                MAIN_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler)],
+                MAIN_MENU: [CallbackQueryHandler(main_menu_handler)],
                 INSTA_MODE: [CommandHandler("rst", insta_reset_command), CommandHandler("blk", insta_bulk_command), MessageHandler(filters.TEXT & ~filters.COMMAND, insta_mode_handler)],
             },
             fallbacks=[CommandHandler("mode", mode_command)],
-            allow_reentry=True
+            allow_reentry=True,
+            per_message=False
         )
         application.add_handler(conv_handler)
         application.add_handler(CommandHandler("genpass", genpass_command))
@@ -335,6 +425,7 @@ async def initialize_bot():
         if webhook_info.url == full_webhook_url:
             logger.info("SUCCESS: Webhook verification passed.")
             bot_status.update({"initialized": True, "webhook_verified": True, "error": None})
+            bot_ready.set()
         else:
             error_msg = f"Webhook verification FAILED. Expected '{full_webhook_url}', but got '{webhook_info.url}'"
             logger.critical(f"FATAL: {error_msg}")
@@ -350,42 +441,77 @@ async def initialize_bot():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manages bot startup and shutdown."""
-    asyncio.create_task(initialize_bot())
+    app.state.init_task = asyncio.create_task(initialize_bot())
     yield
-    if application: logger.info("Shutting down..."); await application.stop()
+    if not app.state.init_task.done():
+        app.state.init_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await app.state.init_task
+    if application:
+        logger.info("Shutting down...")
+        if application.running:
+            await application.stop()
+        await application.shutdown()
 
 app = FastAPI(title="Telegram Utility Bot", lifespan=lifespan)
 
+# Static responses, serialized once and reused for every request
+ROOT_RESPONSE = Response(
+    content=orjson.dumps({"status": "ok", "message": "Bot server is running. Use /health for status."}),
+    media_type="application/json"
+)
+INVALID_TOKEN_RESPONSE = Response(
+    content=orjson.dumps({"status": "invalid token"}),
+    media_type="application/json",
+    status_code=401
+)
+
 @app.get("/", include_in_schema=False)
 async def root_path():
-    return JSONResponse(content={"status": "ok", "message": "Bot server is running. Use /health for status."})
+    return ROOT_RESPONSE
 
 
 @app.get("/health", include_in_schema=False)
 async def health_check():
     if bot_status["initialized"] and bot_status["webhook_verified"]:
-        return JSONResponse(content={"status": "ok", "message": "Bot is initialized and webhook is verified.", "details": bot_status["details"]})
+        return ORJSONResponse(content={"status": "ok", "message": "Bot is initialized and webhook is verified.", "details": bot_status["details"]})
     else:
-        return JSONResponse(
+        return ORJSONResponse(
             content={"status": "error", "message": "Bot is not healthy.", "details": bot_status},
             status_code=503
         )
 
 @app.post("/{token}")
 async def webhook_endpoint(token: str, request: Request):
-    if token != TELEGRAM_TOKEN: return JSONResponse(content={"status": "invalid token"}, status_code=401)
-    if not (application and bot_status["initialized"]): 
-        return JSONResponse(content={"status": "service unavailable, bot not initialized"}, status_code=503)
+    if not hmac.compare_digest(token.encode(), TOKEN_BYTES): return INVALID_TOKEN_RESPONSE
+    if not bot_ready.is_set():
+        # Only hold the delivery while startup is still running; a finished task
+        # that never set bot_ready means initialization failed.
+        if app.state.init_task.done():
+            return ORJSONResponse(content={"status": "service unavailable, bot not initialized"}, status_code=503)
+        try:
+            await asyncio.wait_for(bot_ready.wait(), timeout=STARTUP_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            return ORJSONResponse(content={"status": "service unavailable, bot not initialized"}, status_code=503)
     try:
-        data = await request.json()
+        data = orjson.loads(await request.body())
         update = Update.de_json(data, application.bot)
-        await application.process_update(update)
-        return JSONResponse(content={"status": "ok"})
+        await application.update_queue.put(update)
+        return ORJSONResponse(content={"status": "ok"})
     except Exception as e:
         logger.error(f"Error processing webhook: {e}")
-        return JSONResponse(content={"status": "error"}, status_code=500)
+        return ORJSONResponse(content={"status": "error"}, status_code=500)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
-
+    # Single worker only: every worker would register the webhook (dropping pending
+    # updates), run its own rate limiter and keep its own conversation state.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=1,
+        access_log=False
+    )